@@ -305,9 +305,9 @@ def Acquire_Scope_Data(ifn, get_positions, get_channel_description, ip_addresses
 				# move to next position
 				print('position index =', pos[0], '  x =', pos[1], '  y =', pos[2], end='')
 				try:
-					mc.enable
+					mc.enable()
 					#mc.probe_positions = (pos[1], pos[2])
-					mc.disable
+					mc.disable()
 				except KeyboardInterrupt:
 					raise KeyboardInterrupt
 				except:
@@ -441,9 +441,9 @@ def Acquire_Scope_Data_raw(ifn, get_positions, get_channel_description, ip_addre
 					# move to next position
 					print('position index =', pos[0], '  x =', pos[1], '  y =', pos[2], end='')
 					try:
-						mc.enable
+						mc.enable()
 						mc.probe_positions = (pos[1], pos[2])
-						mc.disable
+						mc.disable()
 					except KeyboardInterrupt:
 						raise KeyboardInterrupt
 					except:
@@ -668,9 +668,9 @@ def Acquire_hdf5_from_disk(ifn, disk_folder, get_positions, ip_addresses, get_ch
 		# move to next position
 		print('position index =', pos[0], '  x =', pos[1], '  y =', pos[2], end='')
 		# try:
-		# 	mc.enable
+		# 	mc.enable()
 		# 	#mc.probe_positions = (pos[1], pos[2])
-		# 	mc.disable
+		# 	mc.disable()
 		# except KeyboardInterrupt:
 		# 	raise KeyboardInterrupt
 		# except:
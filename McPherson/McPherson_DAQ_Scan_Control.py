@@ -25,6 +25,7 @@ For hardware documentation:
 
 import time
 import sys
+import logging
 import os.path
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
@@ -376,6 +377,8 @@ class Window(QWidget):
 #=======================================
 if __name__ == '__main__':
 
+	logging.basicConfig(stream=sys.stdout, format='%(message)s')
+	logging.getLogger('spectrometer_controller').setLevel(logging.DEBUG)  # show the spectrometer's status messages
 	app = QApplication(sys.argv)
 	window = Window()
 	window.show()
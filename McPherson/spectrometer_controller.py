@@ -25,7 +25,52 @@ Hardware Documentation:
 
 import serial
 import serial.tools.list_ports
+import sys
 import time
+import logging
+import functools
+
+# Status chatter goes through this logger at DEBUG level. Whether and where it is printed is up to the
+# application, e.g. logging.basicConfig() and logging.getLogger('spectrometer_controller').setLevel(logging.DEBUG)
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Home switch polling interval in sec: start fast, back off while the switch has not changed
+HOME_POLL_MIN_DELAY = 0.1
+HOME_POLL_MAX_DELAY = 0.8
+
+# Response of the '^' (read moving status) command -> (description, is moving)
+MOVING_STATUS = {
+	0: ('Not moving', False),
+	16: ('Slewing', True),
+	1: ('Moving', True),
+	2: ('Moving fast', True),
+	43: ('Somehow moving', True),
+}
+
+def _encode_cmd(s):
+	""" ASCII command as sent on the wire: carriage return added to every command except [SPACE] (according to the manual) """
+	if s == ' ':
+		return s.encode()
+	return (s + '\r\n').encode()
+
+@functools.lru_cache(maxsize=256)
+def _int_cmd(prefix, n):
+	""" Encoded command with an integer argument, e.g. ('+', 3000) -> b'+3000\r\n' """
+	return _encode_cmd(prefix + str(n))
+
+# Fixed commands, encoded once
+_CMD_STOP = _encode_cmd('@')
+_CMD_IS_MOVING = _encode_cmd('^')
+_CMD_HOME_STATUS = _encode_cmd(']')
+_CMD_ENABLE_HOME = _encode_cmd('A8')
+_CMD_A0 = _encode_cmd('A0')
+_CMD_A24 = _encode_cmd('A24')
+_CMD_F1000 = _encode_cmd('F1000,0')
+_CMD_HOME_DOWN = _encode_cmd('-108000')
+_CMD_HOME_UP = _encode_cmd('+72000')
+_CMD_MOVE_UP = _encode_cmd('M+23000')
+_CMD_MOVE_DOWN = _encode_cmd('M-23000')
 
 
 class spectrometer:
@@ -35,7 +80,7 @@ class spectrometer:
 		self.nm_per_rev = 4 # 4 nm/Motor rev, this depends on grating
 
 		self.sp = None
-		self.verbose = verbose
+		self.verbose = verbose  # kept for callers; debug output is controlled by the logger level
 		if comm_port is not None:
 			self.comm_port = comm_port
 		else:
@@ -48,16 +93,13 @@ class spectrometer:
 
 		self.sp = serial.Serial(self.comm_port, timeout=timeout)        # open serial port
 
-		if self.verbose:
-			print('connected as "',self.sp.name,'"',sep='')                # determine and mention which port was really used
+		log.debug('connected as "%s"', self.sp.name)                # determine and mention which port was really used
 
-		if verbose:
-			print('attempting to establish communications with scan controller')
+		log.debug('attempting to establish communications with scan controller')
 		self.id = self.send_cmd(' ')   # initialize - "After power-up, always send an ASCII [SPACE] before any other command is sent"
 		if len(self.id) == 0:
 			self.id = b'(unknown due to no response from Scan Controller)'
-			if verbose:
-				print('Scan Controller did not respond. Initialization already completed?')
+			log.debug('Scan Controller did not respond. Initialization already completed?')
 		else:
 			if self.id[-2:] == "\r\n":
 				self.id = self.id[0:-2]
@@ -93,26 +135,23 @@ class spectrometer:
 
 	def send_cmd(self, s):
 		""" Send ASCII command to scan controller.
+			s is either a str, or bytes already encoded by _encode_cmd (see the _CMD_ constants), which are sent as is.
 			Add carriage return to every command send except [SPACE] (according to the manual).
 			read_until() returns bytes when available and reads until '\n' is found
 			The return string contains the command itself at the beginning and '\r\n' at the end. These are removed from the return of the function.
 		"""
-		c = s
-		if c != ' ':
-			c += '\r\n'
-		cmd = c.encode()
+		cmd = s if isinstance(s, bytes) else _encode_cmd(s)
 		nw = self.sp.write(cmd)
 		if nw != len(cmd):
 			self.sp.flush()     # nominally, waits until all data is written
-		if self.verbose:
-			print('send_cmd("',s,'")', sep='',end='')
-		c_r = self.sp.read_until().decode()
-		if c_r[-2:] == '\r\n':
+		c_r = self.sp.read_until()
+		if c_r[-2:] == b'\r\n':
 			c_r = c_r[:-2]           # truncate cr-lf from end
-		if c_r[0:len(s)] == s:
-			c_r = c_r[len(s):]       # delete copy of cmd from beginning
-		if self.verbose:
-			print(' -->', c_r)
+		echo = cmd[:-2] if cmd[-2:] == b'\r\n' else cmd
+		if c_r[0:len(echo)] == echo:
+			c_r = c_r[len(echo):]       # delete copy of cmd from beginning
+		c_r = c_r.decode()
+		log.debug('send_cmd(%r) --> %s', s, c_r)
 		return c_r
 
 	def flush(self):
@@ -127,52 +166,32 @@ class spectrometer:
 
 	def is_moving(self):
 		'''Read moving status to check if motor is still moving'''
-		resp = self.send_cmd('^')
-		if int(resp) == 0:
-			if self.verbose:
-				print('Not moving')
-			return False
-
-		elif int(resp) == 16:
-			if self.verbose:
-				print('Slewing')
-			return True
-
-		elif int(resp) == 1:
-			if self.verbose:
-				print('Moving')
-			return True
-
-		elif int(resp) == 2:
-			if self.verbose:
-				print('Moving fast')
-			return True
-		
-		elif int(resp) == 43:
-			if self.verbose:
-				print('Somehow moving')
-			return True
-
-		else:
+		resp = self.send_cmd(_CMD_IS_MOVING)
+		status = MOVING_STATUS.get(int(resp))
+		if status is None:
 			print('Unknown moving status, but we set it to moving')
 			return True
 
+		label, moving = status
+		log.debug(label)
+		return moving
+
 	def wait_for_motion_complete(self, delay=0.5):
 		'''Check motor moving status every 0.1 sec until stopped'''
 		
 		while self.is_moving() == True:
 			time.sleep(delay)
-		print('Motor stopped')
+		log.debug('Motor stopped')
 
 #=====================================================================
 
 	def scan_up(self, d):
 		steps = int(d / self.nm_per_rev * self.steps_per_rev)
-		self.send_cmd('+' + str(steps))
+		self.send_cmd(_int_cmd('+', steps))
 
 	def scan_down(self, d):
 		steps = int(d / self.nm_per_rev * self.steps_per_rev)
-		self.send_cmd('-' + str(steps))
+		self.send_cmd(_int_cmd('-', steps))
 
 	def set_speed(self, d):
 		if d < 36:
@@ -181,13 +200,13 @@ class spectrometer:
 			print('Speed should be smaller than 60000sps')
 		else:
 
-			self.send_cmd('V' + str(d))
+			self.send_cmd(_int_cmd('V', d))
 
 	def acquire_speed(self):
 		pass
 
 	def stop_motor(self):
-		self.send_cmd('@')
+		self.send_cmd(_CMD_STOP)
 
 #=====================================================================
 
@@ -198,39 +217,43 @@ class spectrometer:
 		Refer to the instruction manual for the homing procedure
 		'''
 
-		self.send_cmd('A8') # Enable home circuit
+		self.send_cmd(_CMD_ENABLE_HOME) # Enable home circuit
 
-		status = self.send_cmd(']') # Check home switch and try to move
+		status = int(self.send_cmd(_CMD_HOME_STATUS)) # Check home switch and try to move
 		
-		if self.verbose: print('The initial home switch status is', status)
+		log.debug('The initial home switch status is %d', status)
 		
 		# if the current wavelength is below the home wavelength
-		if int(status) == 32:
-			self.send_cmd('M+23000')
+		if status == 32:
+			self.send_cmd(_CMD_MOVE_UP)
+			delay = HOME_POLL_MIN_DELAY
 			while True:           
 				try:
-					resp = self.send_cmd(']')
-					if self.verbose: print('status is', status, ', continue scanning...')
-					if int(resp) == 2:
-						if self.verbose: print('switch is now clear, moving to the next step.')
+					resp = int(self.send_cmd(_CMD_HOME_STATUS))
+					log.debug('status is %d, continue scanning...', resp)
+					if resp == 2:
+						log.debug('switch is now clear, moving to the next step.')
 						self.stop_motor()
 						break
-					time.sleep(0.8)
+					time.sleep(delay)
+					delay = min(2*delay, HOME_POLL_MAX_DELAY)
 				except KeyboardInterrupt:
 					self.stop_motor()
 					
 		# if the current wavelength is above the home wavelength (Home Switch LED doesn't light)                  
-		elif int(status) == 0:            
-			self.send_cmd('M-23000')
+		elif status == 0:            
+			self.send_cmd(_CMD_MOVE_DOWN)
+			delay = HOME_POLL_MIN_DELAY
 			while True:           
 				try:
-					resp = self.send_cmd(']')
-					if self.verbose: print('status is', resp, ', continue scanning...')
-					if int(resp) == 34:
-						if self.verbose: print('switch is now blocked, moving to the next step.')
+					resp = int(self.send_cmd(_CMD_HOME_STATUS))
+					log.debug('status is %d, continue scanning...', resp)
+					if resp == 34:
+						log.debug('switch is now blocked, moving to the next step.')
 						self.stop_motor()
 						break
-					time.sleep(0.8)
+					time.sleep(delay)
+					delay = min(2*delay, HOME_POLL_MAX_DELAY)
 				except KeyboardInterrupt:
 					self.stop_motor()
 					print('Motor stopped by keyboard interruption. Homing procedure aborted.')
@@ -241,15 +264,15 @@ class spectrometer:
 			print('The starting status is: ', status, ' Cannot perform home switching. Please try again.')
 			return False
 		time.sleep(1)
-		self.send_cmd('-108000')
+		self.send_cmd(_CMD_HOME_DOWN)
 		self.wait_for_motion_complete()
-		self.send_cmd('+72000')
+		self.send_cmd(_CMD_HOME_UP)
 		self.wait_for_motion_complete()
-		self.send_cmd('A24')
+		self.send_cmd(_CMD_A24)
 		time.sleep(0.5)
-		self.send_cmd('F1000,0')
+		self.send_cmd(_CMD_F1000)
 		self.wait_for_motion_complete()
-		self.send_cmd('A0')
+		self.send_cmd(_CMD_A0)
 		print('Homing procedure completed.')
 		return True
 
@@ -257,6 +280,8 @@ class spectrometer:
 if __name__ == '__main__':
 	""" standalone """
 
+	logging.basicConfig(stream=sys.stdout, format='%(message)s')
+	log.setLevel(logging.DEBUG)
 	p = spectrometer(verbose=True)
 
 	print('done')
@@ -9,51 +9,355 @@ Created on Tue Oct 24 14:29:25 2017
 """
 
 import math
-from Motor_Control_1D import Motor_Control
+import numpy as np
+from Motor_Control_1D import Motor_Control, MOVING, DISABLED, ALARM, FAULT
 import time
-import numpy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from obstacle_avoidance import BoundaryChecker
-from scipy.optimize import minimize
 
-# TODO: fix calculate_velocity to read from cm_per_turn directly
+try:
+	from numba import njit, prange
+except ImportError:  # numba is optional; the kernels below then run as plain Python
+	prange = range
+	def njit(*args, **kwargs):
+		if len(args) == 1 and callable(args[0]):
+			return args[0]
+		return lambda fn: fn
+
+#############################################################################################
+"""
+Probe <-> motor coordinate kernels, compiled with numba when it is available.
+probe_in, poi, ph are the probe drive geometry (see Motor_Control_2D/3D __init__).
+The _batch variants take arrays of probe positions, e.g. a whole scan plan.
+"""
+@njit(cache=True, fastmath=True)
+def _probe_to_motor_2d(x, y, probe_in, poi, ph):
+	x = probe_in - x
+	y_over_x = y/x
+	
+	D = math.sqrt(x*x + y*y)
+	d2 = ph * abs(x) / D  # = ph/sqrt((y/x)**2+1)
+	Ltc = y_over_x * d2
+	
+	motor_x = D - probe_in
+	motor_y = ph - d2 - (poi + Ltc)*y_over_x
+	
+	return motor_x, motor_y
+
+@njit(cache=True, fastmath=True)
+def _probe_to_motor_3d(x, y, z, probe_in, poi, ph):
+	x = probe_in - x
+	y_over_x = y/x
+	z_over_x = z/x
+	
+	r_xy2 = x*x + y*y
+	D = math.sqrt(r_xy2 + z*z)
+	d2 = ph * abs(x) / math.sqrt(r_xy2)  # = ph/sqrt((y/x)**2+1)
+	poi_Ltc = poi + y_over_x * d2
+	
+	motor_x = D - probe_in
+	motor_y = -ph + d2 + poi_Ltc*y_over_x
+	motor_z = z_over_x * poi_Ltc
+	
+	return motor_x, motor_y, motor_z
+
+@njit(cache=True, fastmath=True)
+def _motor_to_probe_2d(motor_x, motor_y, probe_in, poi, ph):
+	c = ph - motor_y
+	t = (c*poi - ph*math.sqrt(poi*poi + c*c - ph*ph)) / (poi*poi - ph*ph)  # = y/(probe_in - x)
+	x = (motor_x + probe_in) / math.sqrt(1 + t*t)
+	
+	return probe_in - x, t*x
+
+@njit(cache=True, fastmath=True)
+def _motor_to_probe_3d(motor_x, motor_y, motor_z, probe_in, poi, ph):
+	c = ph + motor_y
+	t = (c*poi - ph*math.sqrt(poi*poi + c*c - ph*ph)) / (poi*poi - ph*ph)  # = y/(probe_in - x)
+	u = motor_z / (poi + ph*t/math.sqrt(1 + t*t))  # = z/(probe_in - x)
+	x = (motor_x + probe_in) / math.sqrt(1 + t*t + u*u)
+	
+	return probe_in - x, t*x, u*x
+
+@njit(cache=True, parallel=True)
+def _probe_to_motor_2d_batch(xs, ys, probe_in, poi, ph):
+	n = xs.shape[0]
+	motor_x = np.empty(n)
+	motor_y = np.empty(n)
+	for i in prange(n):
+		motor_x[i], motor_y[i] = _probe_to_motor_2d(xs[i], ys[i], probe_in, poi, ph)
+	return motor_x, motor_y
+
+@njit(cache=True, parallel=True)
+def _probe_to_motor_3d_batch(xs, ys, zs, probe_in, poi, ph):
+	n = xs.shape[0]
+	motor_x = np.empty(n)
+	motor_y = np.empty(n)
+	motor_z = np.empty(n)
+	for i in prange(n):
+		motor_x[i], motor_y[i], motor_z[i] = _probe_to_motor_3d(xs[i], ys[i], zs[i], probe_in, poi, ph)
+	return motor_x, motor_y, motor_z
+
+@njit(cache=True, parallel=True)
+def _motor_to_probe_2d_batch(mxs, mys, probe_in, poi, ph):
+	n = mxs.shape[0]
+	x = np.empty(n)
+	y = np.empty(n)
+	for i in prange(n):
+		x[i], y[i] = _motor_to_probe_2d(mxs[i], mys[i], probe_in, poi, ph)
+	return x, y
+
+@njit(cache=True, parallel=True)
+def _motor_to_probe_3d_batch(mxs, mys, mzs, probe_in, poi, ph):
+	n = mxs.shape[0]
+	x = np.empty(n)
+	y = np.empty(n)
+	z = np.empty(n)
+	for i in prange(n):
+		x[i], y[i], z[i] = _motor_to_probe_3d(mxs[i], mys[i], mzs[i], probe_in, poi, ph)
+	return x, y, z
+
+# Compile at import rather than in the middle of the first move
+_probe_to_motor_2d(0.0, 0.0, 58.0, 118.0, 30.0)
+_probe_to_motor_3d(0.0, 0.0, 0.0, 58.0, 118.0, 30.0)
+_motor_to_probe_2d(0.0, 0.0, 58.0, 118.0, 30.0)
+_motor_to_probe_3d(0.0, 0.0, 0.0, 58.0, 118.0, 30.0)
+
+def _cell(pos):
+	""" 5 cm cell of a probe position, used as path cache key """
+	return int(pos[0]//5), int(pos[1]//5), int(pos[2]//5)
+
+#############################################################################################
+#############################################################################################
+"""
+Class Motor_Control_ND: common part of the multi-axis probe drives; subclasses create one Motor_Control_1D per axis
+and hand them over in axis order
+
+functions: wait_for_motion_complete, sync_position, stop_now, reset_motor, set_zero, enable, disable
+properties: motor_velocity, motor_positions, motor_alarm
+"""
+class Motor_Control_ND:
+	__slots__ = ('_mcs', '_pool', '_last_velocity', '_last_target', '_last_probe')
+	MIN_MOVE = 1e-4  # cm; moves shorter than this on every axis are skipped
+
+	def __init__(self, *mcs):
+		self._mcs = mcs
+
+		# Each motor has its own server, so commands to different axes can be in flight at the same time
+		self._pool = ThreadPoolExecutor(max_workers=len(mcs))
+
+		self._last_velocity = None  # velocity last sent to the motors
+		self._last_target = None  # motor positions at the end of the last completed move
+		self._last_probe = None  # (motor positions, probe position) last commanded or converted
+
+	def _for_each_motor(self, fn, *values):
+		""" Call fn(motor, value, ...) on all motors concurrently; return results in axis order """
+		return tuple(self._pool.map(fn, self._mcs, *values))
+
+	"""
+	Velocity is only resent when it differs from the last one sent, e.g. consecutive points along a scan line
+	"""
+	def _velocity_changed(self, v):
+		if self._last_velocity is not None and all(abs(a - b) < 5e-4 for a, b in zip(v, self._last_velocity)):
+			return False
+		self._last_velocity = tuple(v)
+		return True
+
+	"""
+	Probe geometry as floats, the argument types the kernels are compiled for at import
+	"""
+	def _geometry(self):
+		return float(self.probe_in), float(self.poi), float(self.ph)
+
+	"""
+	Remember where a move ended, unless a motor is disabled or has a drive fault and so may have stopped on the way;
+	then _last_target stays None and the next move reads the real positions. An alarm alone does not count: it can
+	stay latched (e.g. a limit alarm) after the axis reached its target; wait_for_motion_complete reports it.
+	"""
+	def _finish_move(self, mpos, flags):
+		if not any(f & (DISABLED | FAULT) for f in flags):
+			self._last_target = tuple(mpos)
+
+	"""
+	Read the motor positions and use them as the start of the next move; call after the motors
+	were moved outside this class (e.g. jogged by hand or from another program)
+	"""
+	def sync_position(self):
+		self._last_probe = None
+		self._last_target = None  # stays cleared if the read below raises
+		self._last_target = tuple(self.motor_positions)
+		return self._last_target
+
+	"""
+	Probe position last commanded through probe_positions (or last converted from a readback), if the motors
+	are still at the matching motor positions; saves converting the encoder readback to probe space
+	"""
+	def _cached_probe(self, mpos):
+		if self._last_probe is not None:
+			target, probe = self._last_probe
+			if all(abs(a - b) < 1e-3 for a, b in zip(mpos, target)):
+				return probe
+		return None
+
+	#-------------------------------------------------------------------------------------------
+	"""
+	Set and get the target velocity of motor in units of rev/sec
+	"""
+	@property
+	def motor_velocity(self):
+		return self._for_each_motor(lambda mc: mc.motor_speed)
+
+	@motor_velocity.setter
+	def motor_velocity(self, v):
+		if self._velocity_changed(v):
+			self._for_each_motor(lambda mc, speed: setattr(mc, 'motor_speed', speed), v)
+
+	#--------------------------------------------------------------------------------------------------
+	"""
+	Set and get current motor position
+	"""
+	@property
+	def motor_positions(self):
+		return self._for_each_motor(lambda mc: mc.motor_position)
+	
+	@motor_positions.setter
+	def motor_positions(self, mpos):
+		start, self._last_target = self._last_target, None
+		self._for_each_motor(lambda mc, pos: setattr(mc, 'motor_position', pos), mpos)
+
+		self._finish_move(mpos, self.wait_for_motion_complete(start=start))
+
+	"""
+	Set velocity and target of all motors in one go: each axis gets its speed and position
+	commands from its own worker, then wait till the move is done
+	"""
+	def _apply_move(self, mpos, v):
+		def move(mc, pos, speed):
+			if speed is not None:
+				mc.motor_speed = speed
+			mc.motor_position = pos
+
+		speeds = v if self._velocity_changed(v) else (None,) * len(self._mcs)
+		start, self._last_target = self._last_target, None
+		self._for_each_motor(move, mpos, speeds)
+
+		self._finish_move(mpos, self.wait_for_motion_complete(start=start))
+			
+	#-------------------------------------------------------------------------------------------
+	"""
+	Execute after move command send to motor. Wait till motor stops moving.
+	All motors are polled concurrently; the poll interval starts at 20 ms and grows to 0.2 s, so short moves finish quickly.
+	Every 5 min without stopping, positions are compared with the previous check, or with start (the motor positions
+	the move began from, if the caller knows them): motors that still make progress get another 5 min, if none moved
+	by more than 1e-3 cm TimeoutError is raised. Without start the first check only records the positions.
+	post_settle (s) is an optional pause once all motors report stopped, for setups where
+	overshoot must settle before the next command; by default the next command's handshake covers it.
+	Returns the status flags (see Motor_Control_1D.STATUS_BITS) of each motor once none is moving.
+	"""
+	def wait_for_motion_complete(self, post_settle=0.0, start=None):
+		timeout = time.monotonic() + 300
+		last_positions = start
+		n_poll = 0
+
+		while True:
+			try:
+				flags = self._for_each_motor(lambda mc: mc.read_flags())
+
+				if not any(f & MOVING for f in flags):
+					disabled = [mc.name for mc, f in zip(self._mcs, flags) if f & DISABLED]
+					alarm = [mc.name for mc, f in zip(self._mcs, flags) if f & ALARM]
+					if alarm:
+						print(f"Motor {', '.join(alarm)} reports an alarm, see motor_alarm")
+					if disabled:
+						print(f"Motor {', '.join(disabled)} is not moving because it is disabled")
+					elif post_settle > 0:
+						time.sleep(post_settle)
+					return flags
+				elif time.monotonic() > timeout:
+					positions = self.motor_positions
+					if last_positions is not None and all(abs(a - b) < 1e-3 for a, b in zip(positions, last_positions)):
+						raise TimeoutError("Motor has been moving for over 5min without changing position???")
+					last_positions = positions
+					timeout = time.monotonic() + 300
+
+				time.sleep(min(0.02 * 1.3**n_poll, 0.2))
+				n_poll += 1
+
+			except KeyboardInterrupt:
+				# Send stop commands immediately to all motors
+				try:
+					self.stop_now()
+					time.sleep(0.5)  # Brief wait to let stop commands take effect
+				except Exception as e:
+					print(f"Error stopping motors: {str(e)}")
+				finally:
+					print('\n______Motor stopped and Halted due to Ctrl-C______')
+					raise KeyboardInterrupt  # Re-raise to propagate the interrupt
+
+	#--------------------------------------------------------------------------------------------------
+	def stop_now(self):  # Stop motor movement immediately
+		self._last_target = None
+		self._last_probe = None
+		self._for_each_motor(lambda mc: mc.stop_now())
+
+	def set_zero(self):  # Set current position to zero
+		self._last_target = None
+		self._last_probe = None
+		self._for_each_motor(lambda mc: mc.set_zero())
+
+	def reset_motor(self):  # Similar to restart all motors
+		self._last_target = None
+		self._last_probe = None
+		self._last_velocity = None
+		self._for_each_motor(lambda mc: mc.reset_motor())
+
+	@property
+	def motor_alarm(self):
+		return self._for_each_motor(lambda mc: mc.check_alarm)
+
+	#-------------------------------------------------------------------------------------------------
+	def enable(self):
+		def enable_one(mc):
+			mc.enable()
+			if mc.check_alarm == True:
+				mc.clear_alarm()
+
+		self._for_each_motor(enable_one)
+
+	def disable(self):
+		self._for_each_motor(lambda mc: mc.disable())
+
 #############################################################################################
 #############################################################################################
 """
 Class Motor_Control_2D: controls 2D probe drive with 2-motors (x,y) using Motor_Control_1D
 
-functions: wait_for_motion_complete, test_limit, probe_to_motor, calculate_velocity, set_movement_velocity
-properties: motor_velocity, motor_positions, stop_now, reset_motor, set_zero, enable, disable
+functions: wait_for_motion_complete, test_limit, probe_to_motor, calculate_velocity, set_movement_velocity, apply_move,
+           stop_now, reset_motor, set_zero, enable, disable
+properties: motor_velocity, motor_positions, probe_positions, motor_alarm
 """
-class Motor_Control_2D:
+class Motor_Control_2D(Motor_Control_ND):
+	__slots__ = ('x_mc', 'y_mc', 'probe_in', 'poi', 'ph', 'boundary_checker', '_default_speed', '_x_ratio')
 
 	def __init__(self, x_ip_addr = None, y_ip_addr = None, **kwargs):
 		# Get verbose setting from kwargs, default to False
 		verbose = kwargs.get('verbose', False)
 		
-		self.x_mc = Motor_Control(verbose=True, server_ip_addr= x_ip_addr, name='x', cm_per_turn = 0.254, stop_switch_mode=2)
-		self.y_mc = Motor_Control(verbose=True, server_ip_addr= y_ip_addr, name='y', cm_per_turn = 0.508, stop_switch_mode=2)
+		self.x_mc = Motor_Control(verbose=verbose, server_ip_addr= x_ip_addr, name='x', cm_per_turn = 0.254, stop_switch_mode=2)
+		self.y_mc = Motor_Control(verbose=verbose, server_ip_addr= y_ip_addr, name='y', cm_per_turn = 0.508, stop_switch_mode=2)
 		# Velmex model number NN10-0300-E01-21 (short black linear drives)
 		
 		self.probe_in = 58.771 # Distance from chamber wall to chamber center
 		self.poi = 120.5 # Length of probe outside the chamber from pivot to end (needs to be re-measured everytime new probe is installed)
-		self.ph = 20 # Height from probe shaft to center of rotating bar
+		self.ph = 20.0 # Height from probe shaft to center of rotating bar
 		
 		# Initialize boundary checker with the same verbose setting
 		self.boundary_checker = BoundaryChecker(verbose=verbose)
 
-	#-------------------------------------------------------------------------------------------
-	"""
-	Set and get the target velocity of motor in units of rev/sec
-	"""
-	@property
-	def motor_velocity(self):
-		return self.x_mc.motor_speed, self.y_mc.motor_speed
+		self._default_speed = 5.0 # Probe speed in rev/sec of the y motor
+		self._x_ratio = self.y_mc.cm_per_turn / self.x_mc.cm_per_turn # x motor turns per y motor turn for the same distance
 
-	@motor_velocity.setter
-	def motor_velocity(self, v):
-		xv, yv = v
-		self.x_mc.motor_speed = xv
-		self.y_mc.motor_speed = yv
+		super().__init__(self.x_mc, self.y_mc)
 
 	#-------------------------------------------------------------------------------------------
 	"""
@@ -76,131 +380,78 @@ class Motor_Control_2D:
 	Convert probe velocity vector to motor velocity vector
 	"""
 	def calculate_velocity(self, del_x, del_y):
-		default_speed = 5.0
-
-		del_r = math.sqrt(del_x**2 + del_y**2)
-		if del_r == 0:
-			v_x, v_y = 0.0, 0.0
-		else:
-			v_x = default_speed * del_x / del_r
-			v_y = default_speed * del_y / del_r
+		del_r = math.hypot(del_x, del_y)
+		if del_r < self.MIN_MOVE:
+			return 0.0, 0.0
 
-		v_motor_x = v_x * 2  # factor of 2 due to different cm_per_turn
-		v_motor_y = v_y
-
-		v_motor_x = round(v_motor_x, 3)
-		v_motor_y = round(v_motor_y, 3)
+		k = self._default_speed / del_r
+		v_motor_x = self._x_ratio * k * del_x  # x drive moves less per turn
+		v_motor_y = k * del_y
 
 		return v_motor_x, v_motor_y
 
 	#--------------------------------------------------------------------------------------------------
 	"""
-	Set and get current motor position
+	Set velocity and target of both motors in one go, then wait till the move is done
 	"""
-	@property
-	def motor_positions(self):
-		return self.x_mc.motor_position, self.y_mc.motor_position
-	
-	@motor_positions.setter
-	def motor_positions(self, mpos):
-		x_m, y_m = mpos
-		self.x_mc.motor_position = x_m
-		self.y_mc.motor_position = y_m
+	def apply_move(self, motor_x, motor_y, vx, vy):
+		self._apply_move((motor_x, motor_y), (vx, vy))
 
-		self.wait_for_motion_complete()
-			
-	#-------------------------------------------------------------------------------------------
 	"""
-	Execute after move command send to motor. Wait till motor stops moving.
+	Move to motor position (motor_x, motor_y) so that the probe moves on a straight line: the velocity comes from
+	where the motors are (read fresh, they may have been moved outside this class), then each axis gets its speed
+	and position commands from its own worker
 	"""
-	def wait_for_motion_complete(self):
-		timeout = time.time() + 300
-
-		while True:
-			try:
-				x_stat = self.x_mc.motor_status
-				y_stat = self.y_mc.motor_status
-				
-				x_not_moving = x_stat.find('M') == -1
-				y_not_moving = y_stat.find('M') == -1
-
-				if x_not_moving and y_not_moving:
-					time.sleep(0.2)
-					break
-				elif time.time() > timeout:
-					raise TimeoutError("Motor has been moving for over 5min???")
-
-				time.sleep(0.2)
-			except KeyboardInterrupt:
-				self.x_mc.stop_now
-				self.y_mc.stop_now
-				print('\n______Motor stopped and Halted due to Ctrl-C______')
-				raise KeyboardInterrupt
-
-	#--------------------------------------------------------------------------------------------------
-	@property
-	def stop_now(self):  # Stop motor movement immediately
-		self.x_mc.stop_now
-		self.y_mc.stop_now
-
-	@property
-	def set_zero(self):  # Set current position to zero
-		self.x_mc.set_zero
-		self.y_mc.set_zero
-
-	@property
-	def reset_motor(self):  # Similar to restart all motors
-		self.x_mc.reset_motor
-		self.y_mc.reset_motor
-
-	@property
-	def motor_alarm(self):
-		x_al = self.x_mc.check_alarm
-		y_al = self.y_mc.check_alarm
+	def _go_to(self, motor_x, motor_y):
+		self._last_target = None  # stays cleared if the read below raises
+		self._last_target = x_m, y_m = self.motor_positions
+		if abs(motor_x - x_m) < self.MIN_MOVE and abs(motor_y - y_m) < self.MIN_MOVE:
+			return
+		v_motor_x, v_motor_y = self.calculate_velocity(abs(motor_x - x_m), abs(motor_y - y_m))
 
-		return x_al, y_al
+		self.apply_move(motor_x, motor_y, v_motor_x, v_motor_y)
 
 	#-------------------------------------------------------------------------------------------
 	"""
 	Convert probe space dimensions to motor movement in unit of cm 
 	"""
 	def probe_to_motor_LAPD(self, x, y):
-		x = self.probe_in - x
-		
-		D = math.sqrt(x**2 + y**2)
-		d2 = self.ph/math.sqrt((y/x)**2+1)
-		Ltc = y/x * d2
-		
-		motor_x = D - self.probe_in
-		motor_y = self.ph - d2 - (self.poi + Ltc)*y/x
-		
-		return motor_x, motor_y
+		return _probe_to_motor_2d(float(x), float(y), *self._geometry())
 
 	"""
-	Convert encoder feedback from motor to actual probe position using scipy.minimize
+	Convert encoder feedback from motor to actual probe position.
+	With t = y/(probe_in - x), probe_to_motor_LAPD reduces to motor_y = ph - poi*t - ph*sqrt(1+t^2)
+	and motor_x + probe_in = sqrt((probe_in - x)^2 + y^2), so the inverse is solved in closed form.
 	"""
 	def motor_to_probe(self, motor_x, motor_y):
-		def distance_fun(r1, r2):
-			a = numpy.array(r1)
-			b = numpy.array(r2)
-			return numpy.linalg.norm(a-b)
-
-		def fun(x, *args):
-			mx, my = self.probe_to_motor_LAPD(x[0], x[1])
-			return distance_fun((mx, my), args)
-
-		args = [motor_x, motor_y]
-		X0 = [motor_x, motor_y]
-		res = minimize(fun, X0, (args,), options={'maxiter':15000}, method='BFGS')
+		x, y = _motor_to_probe_2d(float(motor_x), float(motor_y), *self._geometry())
 		
-		return round(res.x[0], 3), round(res.x[1], 3)
+		return round(x, 3), round(y, 3)
+
+	"""
+	Array versions of probe_to_motor_LAPD and motor_to_probe, e.g. for a whole scan plan
+	"""
+	def probe_to_motor_LAPD_batch(self, xs, ys):
+		xs = np.asarray(xs, dtype=float).ravel()
+		ys = np.asarray(ys, dtype=float).ravel()
+		return _probe_to_motor_2d_batch(xs, ys, *self._geometry())
+
+	def motor_to_probe_batch(self, mxs, mys):
+		mxs = np.asarray(mxs, dtype=float).ravel()
+		mys = np.asarray(mys, dtype=float).ravel()
+		x, y = _motor_to_probe_2d_batch(mxs, mys, *self._geometry())
+		return np.round(x, 3), np.round(y, 3)
 
 	#-------------------------------------------------------------------------------------------------
 	@property
 	def probe_positions(self):
 		"""Get current probe position directly from motors"""
 		x_m, y_m = self.motor_positions
-		return self.motor_to_probe(x_m, y_m)
+		probe = self._cached_probe((x_m, y_m))
+		if probe is None:
+			probe = self.motor_to_probe(x_m, y_m)
+			self._last_probe = (x_m, y_m), probe
+		return probe
 
 	@probe_positions.setter
 	def probe_positions(self, pos):
@@ -218,28 +469,52 @@ class Motor_Control_2D:
 			if not motor_boundary(*motor_pos):
 				raise ValueError(f"Target position {pos} is outside motor limits")
 
-		# Set movement velocity
-		self.set_movement_velocity(motor_x, motor_y)
-
 		# Move motor
-		self.motor_positions = motor_x, motor_y
+		self._go_to(motor_x, motor_y)
+		self._last_probe = (motor_x, motor_y), (round(float(xpos), 3), round(float(ypos), 3))
 
 	#-------------------------------------------------------------------------------------------------
-	@property
-	def enable(self):
-		self.x_mc.enable
-		self.y_mc.enable
+	"""
+	Raster scan over probe positions xs (along a row) by ys (one row each), snaking so every other row runs backwards.
+	Motor targets of the whole grid are computed and checked before anything moves; along a row the
+	velocity is set once, from the row's start and end, instead of per point.
+	Generator: yields the probe position (x, y) after each point is reached, e.g.
+		for pos in mc.run_scan(xs, ys):
+			acquire(pos)
+	"""
+	def run_scan(self, xs, ys):
+		xs = np.asarray(xs, dtype=float)
+		ys = np.asarray(ys, dtype=float)
+		nx, ny = len(xs), len(ys)
 
-		if self.x_mc.check_alarm == True:
-			self.x_mc.clear_alarm
-		
-		if self.y_mc.check_alarm == True:
-			self.y_mc.clear_alarm
+		grid_x = np.tile(xs, (ny, 1))
+		grid_x[1::2] = grid_x[1::2, ::-1]
+		grid_y = np.repeat(ys, nx).reshape(ny, nx)
 
-	@property
-	def disable(self):
-		self.x_mc.disable
-		self.y_mc.disable
+		if np.any(np.hypot(grid_x, grid_y) > 40):
+			raise ValueError("Scan grid reaches too close to the chamber wall.")
+
+		motor_x, motor_y = self.probe_to_motor_LAPD_batch(grid_x, grid_y)
+		motor_x = motor_x.reshape(ny, nx).tolist()
+		motor_y = motor_y.reshape(ny, nx).tolist()
+
+		for row in range(ny):
+			for col in range(nx):
+				for motor_boundary in self.boundary_checker.motor_boundaries:
+					if not motor_boundary(motor_x[row][col], motor_y[row][col], 0):
+						raise ValueError(f"Scan position {(grid_x[row, col], grid_y[row, col])} is outside motor limits")
+
+		for row in range(ny):
+			# Straight line to the start of the row
+			mx, my = motor_x[row][0], motor_y[row][0]
+			self._go_to(mx, my)
+			yield float(grid_x[row, 0]), float(grid_y[row, 0])
+
+			if nx > 1:
+				self.motor_velocity = self.calculate_velocity(abs(motor_x[row][-1] - mx), abs(motor_y[row][-1] - my))
+			for col in range(1, nx):
+				self.motor_positions = motor_x[row][col], motor_y[row][col]
+				yield float(grid_x[row, col]), float(grid_y[row, col])
 
 #############################################################################################
 #############################################################################################
@@ -247,10 +522,14 @@ class Motor_Control_2D:
 """
 Class Motor_Control_3D: controls 3D probe drive with 3-motors (x,y,z) using Motor_Control_1D
 
-functions: wait_for_motion_complete, test_limit, probe_to_motor, calculate_velocity, set_movement_velocity
-properties: motor_velocity, motor_positions, stop_now, reset_motor, set_zero, enable, disable
+functions: wait_for_motion_complete, test_limit, probe_to_motor, calculate_velocity, set_movement_velocity, add_common_path,
+           stop_now, reset_motor, set_zero, enable, disable
+properties: motor_velocity, motor_positions, probe_positions, motor_alarm
 """
-class Motor_Control_3D:
+class Motor_Control_3D(Motor_Control_ND):
+	__slots__ = ('x_mc', 'y_mc', 'z_mc', 'probe_in', 'poi', 'ph', 'boundary_checker', '_default_speed',
+	             '_path_cache', '_common_paths')
+
 	def __init__(self, *args, **kwargs):
 		# Get verbose setting from kwargs, default to False
 		verbose = kwargs.get('verbose', False)
@@ -261,31 +540,21 @@ class Motor_Control_3D:
 		self.z_mc = Motor_Control(verbose=verbose, server_ip_addr=args[2], name='z', cm_per_turn=0.254, stop_switch_mode=1)
 		# Velmex model number NN10-0300-E01-21 (short black linear drives)
 		
-		self.probe_in = 58 # Distance from ball valve center to chamber center
-		self.poi = 118 # Length of probe outside the chamber from pivot to end
-		self.ph = 30 # Height from probe shaft to center of rotating bar
+		self.probe_in = 58.0 # Distance from ball valve center to chamber center
+		self.poi = 118.0 # Length of probe outside the chamber from pivot to end
+		self.ph = 30.0 # Height from probe shaft to center of rotating bar
+
+		self._default_speed = 2.0 # Speed in rev/sec of the motor with the longest move
+
+		super().__init__(self.x_mc, self.y_mc, self.z_mc)
 
 		self.motor_velocity = 4, 4, 4
 		
 		# Initialize boundary checker with the same verbose setting
 		self.boundary_checker = BoundaryChecker(verbose=verbose)
-		
-		self._current_pos = None
-
-	#-------------------------------------------------------------------------------------------
-	"""
-	Set and get the target velocity of motor in units of rev/sec
-	"""
-	@property
-	def motor_velocity(self):
-		return self.x_mc.motor_speed, self.y_mc.motor_speed, self.z_mc.motor_speed
 
-	@motor_velocity.setter
-	def motor_velocity(self, v):
-		xv, yv, zv = v
-		self.x_mc.motor_speed = xv
-		self.y_mc.motor_speed = yv
-		self.z_mc.motor_speed = zv
+		self._path_cache = OrderedDict()  # (start cell, end cell) -> intermediate waypoints of recent detours
+		self._common_paths = {}  # name -> (start_region, end_region, intermediate waypoints)
 
 	#-------------------------------------------------------------------------------------------
 	"""
@@ -300,159 +569,65 @@ class Motor_Control_3D:
 		delta_y = abs(motor_y - y_m)
 		delta_z = abs(motor_z - z_m)
 
-		# Find the largest distance to determine which motor should run at max speed
-		max_delta = max(delta_x, delta_y, delta_z)
-		default_speed = 2.0  # Maximum speed in rev/sec
-		
-		if max_delta == 0:
-			self.motor_velocity = 0.0, 0.0, 0.0
-			return
-			
-		# Calculate velocities - the motor with largest distance will run at max speed
-		v_x = default_speed * delta_x / max_delta
-		v_y = default_speed * delta_y / max_delta
-		v_z = default_speed * delta_z / max_delta
-
-		# Round to 3 decimal places to avoid floating point issues
-		v_motor_x = round(v_x, 3)
-		v_motor_y = round(v_y, 3)
-		v_motor_z = round(v_z, 3)
-
 		# Set motor velocity accordingly
-		self.motor_velocity = v_motor_x, v_motor_y, v_motor_z
-
-	#--------------------------------------------------------------------------------------------------
-	"""
-	Set and get current motor position
-	"""
-	@property
-	def motor_positions(self):
-		self._current_pos = self.x_mc.motor_position, self.y_mc.motor_position, self.z_mc.motor_position
-		return self._current_pos
-	
-	@motor_positions.setter
-	def motor_positions(self, mpos):
-		x_m, y_m, z_m = mpos
-		self.x_mc.motor_position = x_m
-		self.y_mc.motor_position = y_m
-		self.z_mc.motor_position = z_m
+		self.motor_velocity = self.calculate_velocity(delta_x, delta_y, delta_z)
 
-		self.wait_for_motion_complete()
-			
-	#-------------------------------------------------------------------------------------------
 	"""
-	Execute after move command send to motor. Wait till motor stops moving.
+	Convert motor displacements to motor velocities: the motor with the largest distance runs at default speed,
+	the others are scaled so all motors arrive together (all drives have the same cm_per_turn)
 	"""
-	def wait_for_motion_complete(self):
-		timeout = time.time() + 300
-
-		while True:
-			try:
-				x_stat = self.x_mc.motor_status
-				y_stat = self.y_mc.motor_status
-				z_stat = self.z_mc.motor_status
-
-				x_disabled = x_stat.find('D') == 1
-				y_disabled = y_stat.find('D') == 1
-				z_disabled = z_stat.find('D') == 1
-				if x_disabled or y_disabled or z_disabled:
-					print("Motor is not moving because it is disabled")
-					break
-
-				x_not_moving = x_stat.find('M') == -1
-				y_not_moving = y_stat.find('M') == -1
-				z_not_moving = z_stat.find('M') == -1
-				
-				if x_not_moving and y_not_moving and z_not_moving:
-					time.sleep(0.2)
-					break
-				elif time.time() > timeout:
-					raise TimeoutError("Motor has been moving for over 5min???")
-
-				time.sleep(0.2)
-
-			except KeyboardInterrupt:
-				# Send stop commands immediately to all motors
-				try:
-					self.x_mc.stop_now
-					self.y_mc.stop_now
-					self.z_mc.stop_now
-					time.sleep(0.5)  # Brief wait to let stop commands take effect
-				except Exception as e:
-					print(f"Error stopping motors: {str(e)}")
-				finally:
-					print('\n______Motor stopped and Halted due to Ctrl-C______')
-					raise KeyboardInterrupt  # Re-raise to propagate the interrupt
-
-	#--------------------------------------------------------------------------------------------------
-	@property
-	def stop_now(self):  # Stop motor movement immediately
-		self.x_mc.stop_now
-		self.y_mc.stop_now
-		self.z_mc.stop_now
+	def calculate_velocity(self, del_x, del_y, del_z):
+		max_delta = max(del_x, del_y, del_z)
+		if max_delta < self.MIN_MOVE:
+			return 0.0, 0.0, 0.0
 
-	@property
-	def set_zero(self):  # Set current position to zero
-		self.x_mc.set_zero
-		self.y_mc.set_zero
-		self.z_mc.set_zero
-
-	@property
-	def reset_motor(self):  # Similar to restart all motors
-		self.x_mc.reset_motor
-		self.y_mc.reset_motor
-		self.z_mc.reset_motor
-
-	@property
-	def motor_alarm(self):
-		x_al = self.x_mc.check_alarm
-		y_al = self.y_mc.check_alarm
-		z_al = self.z_mc.check_alarm
-
-		return x_al, y_al, z_al
+		k = self._default_speed / max_delta
+		return k * del_x, k * del_y, k * del_z
 
 	#-------------------------------------------------------------------------------------------
 	"""
 	Convert probe space dimensions to motor movement in unit of cm 
 	"""
 	def probe_to_motor_LAPD(self, x, y, z):
-		x = self.probe_in - x
-		
-		D = math.sqrt(x**2 + y**2 + z**2)
-		d2 = self.ph/math.sqrt((y/x)**2+1)
-		Ltc = y/x * d2
-		
-		motor_x = D - self.probe_in
-		motor_y = -self.ph + d2 + (self.poi + Ltc)*y/x
-		motor_z = z/x * (self.poi+ Ltc)
-		
-		return motor_x, motor_y, motor_z
+		return _probe_to_motor_3d(float(x), float(y), float(z), *self._geometry())
 
 	"""
-	Convert encoder feedback from motor to actual probe position using scipy.minimize
+	Convert encoder feedback from motor to actual probe position.
+	With t = y/(probe_in - x), probe_to_motor_LAPD reduces to motor_y = -ph + poi*t + ph*sqrt(1+t^2),
+	motor_z = z/(probe_in - x) * (poi + Ltc) and motor_x + probe_in = |probe vector|, so the inverse is solved in closed form.
 	"""
 	def motor_to_probe(self, motor_x, motor_y, motor_z):
-		def distance_fun(r1, r2):
-			a = numpy.array(r1)
-			b = numpy.array(r2)
-			return numpy.linalg.norm(a-b)
-
-		def fun(x, *args):
-			mx, my, mz = self.probe_to_motor_LAPD(x[0], x[1], x[2])
-			return distance_fun((mx, my, mz), args)
-
-		args = [motor_x, motor_y, motor_z]
-		X0 = [motor_x, motor_y, motor_z]
-		res = minimize(fun, X0, (args,), options={'maxiter':15000}, method='BFGS')
+		x, y, z = _motor_to_probe_3d(float(motor_x), float(motor_y), float(motor_z), *self._geometry())
 		
-		return round(res.x[0], 3), round(res.x[1], 3), round(res.x[2], 3)
+		return round(x, 3), round(y, 3), round(z, 3)
+
+	"""
+	Array versions of probe_to_motor_LAPD and motor_to_probe, e.g. for checking a whole trajectory
+	with boundary_checker.is_positions_valid
+	"""
+	def probe_to_motor_LAPD_batch(self, xs, ys, zs):
+		xs = np.asarray(xs, dtype=float).ravel()
+		ys = np.asarray(ys, dtype=float).ravel()
+		zs = np.asarray(zs, dtype=float).ravel()
+		return _probe_to_motor_3d_batch(xs, ys, zs, *self._geometry())
+
+	def motor_to_probe_batch(self, mxs, mys, mzs):
+		mxs = np.asarray(mxs, dtype=float).ravel()
+		mys = np.asarray(mys, dtype=float).ravel()
+		mzs = np.asarray(mzs, dtype=float).ravel()
+		x, y, z = _motor_to_probe_3d_batch(mxs, mys, mzs, *self._geometry())
+		return np.round(x, 3), np.round(y, 3), np.round(z, 3)
 
 	#-------------------------------------------------------------------------------------------------
 	@property
 	def probe_positions(self):
 		"""Get current probe position directly from motors"""
 		x_m, y_m, z_m = self.motor_positions
-		return self.motor_to_probe(x_m, y_m, z_m)
+		probe = self._cached_probe((x_m, y_m, z_m))
+		if probe is None:
+			probe = self.motor_to_probe(x_m, y_m, z_m)
+			self._last_probe = (x_m, y_m, z_m), probe
+		return probe
 
 	@probe_positions.setter
 	def probe_positions(self, pos):
@@ -479,29 +654,41 @@ class Motor_Control_3D:
 				raise ValueError(f"Target position {probe_pos} is outside motor limits")
 
 		try:
+			# Plan from the measured position, the drives may have been moved outside this class;
+			# the cached probe position is only reused if it matches the readback
 			mpos_current = self.motor_positions
-			current_pos = self.motor_to_probe(*mpos_current)
+			current_pos = self._cached_probe(mpos_current) or self.motor_to_probe(*mpos_current)
 			# Get waypoints from boundary checker
-			waypoints = self.boundary_checker.find_path(current_pos, probe_pos)
+			waypoints = self._find_path(current_pos, probe_pos)
+
+			# The last waypoint is the target, checked and converted above; convert the detour waypoints
+			# at once and verify them before anything moves
+			via = waypoints[:-1]
+			waypoints_motor = []
+			if via:
+				valid, wp_motor = self._check_waypoints(via)
+				if not valid.all():
+					bad = int(np.argmin(valid))
+					raise ValueError(f"Waypoint {via[bad]} (motor position {tuple(wp_motor[bad])}) is outside probe or motor limits")
+				waypoints_motor = [tuple(m) for m in wp_motor.tolist()]
+			waypoints_motor.append(motor_pos)
 			
 			# Move through each waypoint
-			for waypoint in waypoints:
-				# Convert to motor coordinates for this segment
-				motor_x, motor_y, motor_z = self.probe_to_motor_LAPD(*waypoint)
-				mpos_target = motor_x, motor_y, motor_z
-				
-				# Verify motor position is within limits
-				for motor_boundary in self.boundary_checker.motor_boundaries:
-					if not motor_boundary(motor_x, motor_y, motor_z):
-						raise ValueError(f"Waypoint motor position {(motor_x, motor_y, motor_z)} is outside motor limits")
+			for mpos_target in waypoints_motor:
+				motor_x, motor_y, motor_z = mpos_target
+				if max(abs(a - b) for a, b in zip(mpos_target, mpos_current)) < self.MIN_MOVE:
+					continue
 				
 				# Set velocity for this segment
 				self.set_movement_velocity(mpos_current, mpos_target)
 				
-				# Move to waypoint
+				# Move to waypoint; the next segment starts from this target, no need to read it back
 				self.motor_positions = motor_x, motor_y, motor_z
-				mpos_current = self.motor_positions
+				if self._last_target is None:
+					raise ValueError(f"Motors stopped before reaching waypoint motor position {mpos_target}")
+				mpos_current = mpos_target
 
+			self._last_probe = motor_pos, tuple(round(float(p), 3) for p in probe_pos)
 				
 		except ValueError as e:
 			raise ValueError(f"Cannot find safe path to ({xpos}, {ypos}, {zpos}): {str(e)}")
@@ -510,30 +697,56 @@ class Motor_Control_3D:
 
 
 	#-------------------------------------------------------------------------------------------------
-	@property
-	def enable(self):
-		self.x_mc.enable
-		self.y_mc.enable
-		self.z_mc.enable
-
-		if self.x_mc.check_alarm == True:
-			self.x_mc.clear_alarm
-		
-		if self.y_mc.check_alarm == True:
-			self.y_mc.clear_alarm
-			
-		if self.z_mc.check_alarm == True:
-			self.z_mc.clear_alarm
+	def add_common_path(self, name, start_region, end_region, waypoints):
+		"""Add a pre-calculated path for common movements
+		Args:
+			start_region, end_region: functions (x, y, z) returning True inside the region, e.g. AxisAlignedBox
+			waypoints: probe positions to pass through between start and target
+		"""
+		self._common_paths[name] = (start_region, end_region, tuple(waypoints))
 
-	@property
-	def disable(self):
-		self.x_mc.disable
-		self.y_mc.disable
-		self.z_mc.disable
+	"""
+	Motor positions of the probe positions pts, and a mask of the ones inside both probe and motor boundaries
+	"""
+	def _check_waypoints(self, pts):
+		wp = np.array(pts, dtype=float)
+		wp_motor = np.column_stack(self.probe_to_motor_LAPD_batch(wp[:, 0], wp[:, 1], wp[:, 2]))
+		return self.boundary_checker.is_positions_valid(wp, wp_motor), wp_motor
 
-	def add_common_path(self, name, start_region, end_region, waypoints):
-		"""Add a pre-calculated path for common movements"""
-		self._common_paths[name] = (start_region, end_region, waypoints)
+	"""
+	Waypoints from start_pos to end_pos (last one is end_pos). A valid straight line is always taken; otherwise, before
+	searching, the detour of a recent move between the same 5 cm cells and any matching common path are tried; a candidate is used if all its segments are valid
+	and its waypoints are within motor limits, otherwise the next one (and finally the boundary checker) is asked.
+	"""
+	def _find_path(self, start_pos, end_pos):
+		if self.boundary_checker.is_path_valid(start_pos, end_pos):
+			return [end_pos]
+
+		key = _cell(start_pos), _cell(end_pos)
+
+		candidates = []
+		if key in self._path_cache:
+			self._path_cache.move_to_end(key)
+			candidates.append(self._path_cache[key])
+		for start_region, end_region, via in self._common_paths.values():
+			if start_region(*start_pos) and end_region(*end_pos):
+				candidates.append(via)
+
+		for via in candidates:
+			points = [start_pos, *via, end_pos]
+			if not self.boundary_checker.is_path_batch_valid(points[:-1], points[1:]).all():
+				continue
+			if via and not self._check_waypoints(via)[0].all():
+				continue
+			return [*via, end_pos]
+
+		waypoints = self.boundary_checker.find_path(start_pos, end_pos)
+		if len(waypoints) > 1:
+			self._path_cache[key] = tuple(waypoints[:-1])
+			self._path_cache.move_to_end(key)
+			if len(self._path_cache) > 32:
+				self._path_cache.popitem(last=False)
+		return waypoints
 
 #===============================================================================================================================================
 #<o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o> <o>
@@ -22,6 +22,7 @@ import socket
 import select
 import time
 import logging
+import functools
 
 #steps_per_turn = 20000
 #encoder_step = 4000
@@ -29,15 +30,35 @@ import logging
 # TODO: 'DL2' should be sent to motor when limit switch is connected properly
 #       Add boolean in init to choose when stop switch is connected or not
 
+@functools.lru_cache(maxsize=256)
+def _frame(text):
+    """ Command as sent to the motor server: 0x00 0x07 header, ASCII text, carriage return """
+    return b'\x00\x07' + text.encode('ASCII') + b'\r'
+
+STATUS_CODES = 'ADEFHJMPRSTW'  # RS status letters, see motor_status
+STATUS_BITS = {code: 1 << i for i, code in enumerate(STATUS_CODES)}
+MOVING = STATUS_BITS['M']
+DISABLED = STATUS_BITS['D']
+ALARM = STATUS_BITS['A']
+FAULT = STATUS_BITS['E']
+
+@functools.lru_cache(maxsize=64)
+def _status_flags(status):
+    """ RS reply (e.g. '\x00\x07RS=MR\r') as a bitmask of STATUS_BITS """
+    flags = 0
+    for code in status.partition('=')[2]:
+        flags |= STATUS_BITS.get(code, 0)
+    return flags
+
 #===============================================================================================================================================
 #===============================================================================================================================================
 
 """
 Motor control class that connects to motor through Socket.
 Functions: send_text, cm_to_steps, steps_to_cm, set_acceleration, set_decceleration, inhibit
-            stop_now
-Properties: steps_per_rev, motor_status, motor_speed, instant_velocity, motor_position
-            set_zero, check_alarm, clear_alarm, reset_motor, enable, disable
+            stop_now, set_zero, clear_alarm, reset_motor, enable, disable
+Properties: steps_per_rev, motor_status, motor_flags, is_moving, motor_speed, instant_velocity, motor_position
+            check_alarm
 """
 
 class Motor_Control:
@@ -45,6 +66,8 @@ class Motor_Control:
     MSIPA_CACHE_FN = 'motor_server_ip_address_cache.tmp'
     MOTOR_SERVER_PORT = 7776
     BUF_SIZE = 1024
+    STATUS_CACHE_TTL = 0.05  # sec; motor_status and motor_position reads younger than this are reused
+    QUERY_COMMANDS = ('RS', 'EP', 'SP', 'VE', 'IV', 'ER', 'EG', 'AL', 'IE', 'IP')  # commands that do not change motor state
     # server_ip_addr = '10.10.10.10' # for direct ethernet connection to PC
 
     # - - - - - - - - - - - - - - - - -
@@ -56,6 +79,7 @@ class Motor_Control:
         self.stop_switch_mode = str(stop_switch_mode)
         self.verbose = verbose
         self.name = name
+        self._cache = {}
         if msipa_cache_fn == None:
             self.msipa_cache_fn = self.MSIPA_CACHE_FN
         else:
@@ -117,13 +141,13 @@ class Motor_Control:
             print('Drive is hitting a stop switch at ', pos)
         else:
             print('Unknown alarm ', alarm)
-            self.clear_alarm
+            self.clear_alarm()
             print(self.name, ' current status ', cur_stat)
         
 #         if self.motor_speed == 10:
 #             print('Motor has likely been power cycled and lost zero position')
 #             print('Motor disabled until futher action')
-#             self.disable
+#             self.disable()
 
 
 
@@ -158,6 +182,9 @@ class Motor_Control:
     def send_text(self, text, timeout:int=None, receive=True) -> str:
         """worker for below - opens a connection to send commands to the motor control server, closes when done"""
         """ note: timeout is not working - needs some MS specific iocontrol stuff (I think) """
+        if text not in self.QUERY_COMMANDS:
+            self.invalidate_cache()  # command may change motor state; cached status is stale
+
         RETRIES = 30
         retry_count = 0
         while retry_count < RETRIES:  # Retries added 17-07-11
@@ -186,15 +213,7 @@ class Motor_Control:
             return self.send_text(text, timeout)  # tail-recurse if retry is requested
 
 
-        message = bytearray(text, encoding = 'ASCII')
-        buf = bytearray(2)
-        buf[0] = 0
-        buf[1] = 7
-        for i in range(len(message)):
-            buf.append(message[i])
-        buf.append(13)
-
-        s.send(buf)
+        s.send(_frame(text))
 
         if receive:
             BUF_SIZE = 2048
@@ -262,7 +281,46 @@ class Motor_Control:
         # 	# T = Wait Time (WT command executing)
         # 	# W = Wait Input (WI command executing)
         # 	""")
-        return self.send_text('RS')
+        status = self._cached('RS')
+        if status is None:
+            status = self.read_status()
+        return status
+
+    def read_status(self):
+        """ motor_status straight from the drive, bypassing the cache; for loops waiting on a status change """
+        return self._store('RS', self.send_text('RS'))
+
+    @property
+    def motor_flags(self):
+        """ motor_status as a bitmask, test with e.g. motor_flags & MOVING """
+        return _status_flags(self.motor_status)
+
+    def read_flags(self):
+        """ read_status as a bitmask """
+        return _status_flags(self.read_status())
+
+    @property
+    def is_moving(self):
+        """ True while a motion is in progress ('M' in motor_status) """
+        return bool(self.motor_flags & MOVING)
+
+#-------------------------------------------------------------------------------------------
+    """
+    Short-lived cache of status/position reads, so callers polling several properties in a row
+    do not pay a network round-trip for each. Any state-changing command clears it (see send_text).
+    """
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.STATUS_CACHE_TTL:
+            return entry[0]
+        return None
+
+    def _store(self, key, value):
+        self._cache[key] = (value, time.monotonic())
+        return value
+
+    def invalidate_cache(self):
+        self._cache.clear()
 
 #-------------------------------------------------------------------------------------------
 
@@ -287,8 +345,8 @@ class Motor_Control:
 
     @motor_speed.setter
     def motor_speed(self, speed):
-    
-        self.send_text('VE'+str(speed))
+        """ speed in rev/sec, sent with 0.001 rev/sec resolution """
+        self.send_text('VE'+str(round(speed, 3)))
 
     @property
     def instant_velocity(self):
@@ -308,6 +366,14 @@ class Motor_Control:
         '''Return current motor position in cm. Note that encoder resolution is different from steps_per_turn.
             set_motor position: Call to move motor with input in cm, convert to steps and send to motor
         '''
+        pos = self._cached('position')
+        if pos is None:
+            pos = self._read_position()
+            if pos is not None:
+                self._store('position', pos)
+        return pos
+
+    def _read_position(self):
         
         RETRIES = 100
         retry_count = 0
@@ -380,7 +446,6 @@ class Motor_Control:
         self.send_text('ST')
 
 #-------------------------------------------------------------------------------------------
-    @property
     def set_zero(self):
         """ Set motor position and encoder position to zero
         """
@@ -407,7 +472,6 @@ class Motor_Control:
 
 
 #-------------------------------------------------------------------------------------------
-    @property
     def reset_motor(self):
 
         self.send_text('RE',receive=False)
@@ -417,12 +481,13 @@ class Motor_Control:
     def check_alarm(self):
 
         if 'A' in self.motor_status:
-            resp = self.send_text('AL')
+            resp = self._cached('AL')
+            if resp is None:
+                resp = self._store('AL', self.send_text('AL'))
             return resp
         else:
             return False
 
-    @property
     def clear_alarm(self):
         self.send_text('AR',receive=False)
         print(self.name + '-motor: Clear alarm on motor')
@@ -457,11 +522,9 @@ class Motor_Control:
         return True
 
 
-    @property
     def enable(self):
          return self.inhibit(False)
 
-    @property
     def disable(self):
         return self.inhibit(True)
 
@@ -1,12 +1,60 @@
+import math
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import inspect
 import re
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; the box predicates then run as plain Python
+    prange = range
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
 #===============================================================================================================================================
 #===============================================================================================================================================
 
+@njit(cache=True)
+def _box_pred(x, y, z, lo, hi):
+    return (lo[0] <= x <= hi[0]) and (lo[1] <= y <= hi[1]) and (lo[2] <= z <= hi[2])
+
+@njit(cache=True, parallel=True)
+def _box_pred_batch(pts, lo, hi):
+    n = pts.shape[0]
+    inside = np.empty(n, dtype=np.bool_)
+    for i in prange(n):
+        inside[i] = _box_pred(pts[i, 0], pts[i, 1], pts[i, 2], lo, hi)
+    return inside
+
+class AxisAlignedBox:
+    """Rectangular region lo <= (x, y, z) <= hi, usable wherever a boundary function is expected.
+    With obstacle=False the box is the valid region (e.g. outer boundary); with obstacle=True it is the region to keep out of.
+    Works on scalars as well as arrays of x, y, z.
+    """
+    __slots__ = ('lo', 'hi', 'obstacle')
+
+    def __init__(self, lo, hi, obstacle=False):
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+        self.obstacle = obstacle
+
+    def contains(self, pts):
+        """Return boolean array, True for rows of the (N, 3) array pts that are inside the box"""
+        return _box_pred_batch(np.ascontiguousarray(pts, dtype=float), self.lo, self.hi)
+
+    def is_valid_batch(self, pts):
+        """Return boolean array, True for rows of the (N, 3) array pts that are valid positions"""
+        inside = self.contains(pts)
+        return ~inside if self.obstacle else inside
+
+    def __call__(self, x, y, z):
+        if np.ndim(x) == 0 and np.ndim(y) == 0 and np.ndim(z) == 0:
+            return _box_pred(float(x), float(y), float(z), self.lo, self.hi) != self.obstacle
+        x, y, z = np.broadcast_arrays(x, y, z)
+        return self.is_valid_batch(np.column_stack((x.ravel(), y.ravel(), z.ravel()))).reshape(x.shape)
+
+
 class BoundaryChecker:
     def __init__(self, verbose=False):
         self.probe_boundaries = []
@@ -17,6 +65,7 @@ class BoundaryChecker:
         self.min_clearance = 1.0
         self.verbose = verbose
         self.safe_x = 0  # Default safe x position when no obstacles
+        self.vectorized_boundaries = set()  # boundary functions that accept arrays of x, y, z
         
     def _debug_print(self, *args, **kwargs):
         """Helper method for debug printing"""
@@ -35,16 +84,40 @@ class BoundaryChecker:
             self.obstacle_boundaries.append(boundary_func)
             # For the first obstacle, set safe_x to be 5cm beyond the obstacle's max x
             if len(self.obstacle_boundaries) == 1:
-                source = inspect.getsource(boundary_func)
-                # Get the second number in the x range (x_max)
-                x_max = float(re.findall(r'-?\d+(?:\.\d+)?', source)[1])
+                if isinstance(boundary_func, AxisAlignedBox):
+                    x_max = float(boundary_func.hi[0])
+                else:
+                    source = inspect.getsource(boundary_func)
+                    # Get the second number in the x range (x_max)
+                    x_max = float(re.findall(r'-?\d+(?:\.\d+)?', source)[1])
                 self.safe_x = x_max + 5  # Set safe_x 5cm beyond obstacle's max x
                 self._debug_print(f"Safe x position set to: {self.safe_x}")
         
+    def add_probe_boundary_vec(self, boundary_func, is_outer_boundary=False):
+        """Same as add_probe_boundary, for a function that also accepts arrays of x, y, z
+        and returns a boolean array (e.g. AxisAlignedBox, or one written with numpy & | instead of and/or).
+        is_positions_valid then checks all points in one call instead of one call per point.
+        """
+        self.vectorized_boundaries.add(boundary_func)
+        self.add_probe_boundary(boundary_func, is_outer_boundary)
+
     def add_motor_boundary(self, boundary_func):
         """Add a boundary function that operates in motor space"""
         self.motor_boundaries.append(boundary_func)
 
+    def add_motor_boundary_vec(self, boundary_func):
+        """Same as add_motor_boundary, for a function that also accepts arrays (see add_probe_boundary_vec)"""
+        self.vectorized_boundaries.add(boundary_func)
+        self.add_motor_boundary(boundary_func)
+
+    def _check_all(self, boundary_func, pts):
+        """Evaluate boundary_func on every row of the (N, 3) array pts"""
+        if isinstance(boundary_func, AxisAlignedBox):
+            return boundary_func.is_valid_batch(pts)
+        if boundary_func in self.vectorized_boundaries:
+            return np.asarray(boundary_func(pts[:, 0], pts[:, 1], pts[:, 2]), dtype=bool)
+        return np.fromiter((boundary_func(*p) for p in pts), dtype=bool, count=len(pts))
+
     def is_position_valid(self, probe_pos, motor_pos=None):
         """Check if position is valid in both spaces"""
         x, y, z = probe_pos
@@ -67,6 +140,30 @@ class BoundaryChecker:
                 
         return True
 
+    def is_positions_valid(self, probe_pts, motor_pts=None):
+        """Batch version of is_position_valid
+        Args:
+            probe_pts: (N, 3) array of probe positions
+            motor_pts: optional (N, 3) array of matching motor positions
+        Returns:
+            boolean array, True where the position is valid in both spaces
+        """
+        probe_pts = np.asarray(probe_pts, dtype=float)
+        valid = np.ones(len(probe_pts), dtype=bool)
+
+        if self.outer_boundary:
+            valid &= self._check_all(self.outer_boundary, probe_pts)
+
+        for obstacle in self.obstacle_boundaries:
+            valid &= self._check_all(obstacle, probe_pts)
+
+        if motor_pts is not None:
+            motor_pts = np.asarray(motor_pts, dtype=float)
+            for boundary in self.motor_boundaries:
+                valid &= self._check_all(boundary, motor_pts)
+
+        return valid
+
     def is_path_valid(self, start_pos, end_pos):
         """Check if straight line path between points is valid"""
         x1, y1, z1 = start_pos
@@ -80,16 +177,16 @@ class BoundaryChecker:
             self._debug_print(f"End position {end_pos} is invalid")
             return False
             
+        dx = x2 - x1
+        dy = y2 - y1
+        dz = z2 - z1
+        
+        # Check several points, with more checks if the distance is larger
+        distance = math.hypot(dx, dy, dz)
+        num_checks = max(5, int(distance))  # At least 5 checks, more for longer distances
+        
         # For each obstacle boundary
         for obstacle in self.obstacle_boundaries:
-            dx = x2 - x1
-            dy = y2 - y1
-            dz = z2 - z1
-            
-            # Check several points, with more checks if the distance is larger
-            distance = np.sqrt(dx*dx + dy*dy + dz*dz)
-            num_checks = max(5, int(distance))  # At least 5 checks, more for longer distances
-            
             for i in range(num_checks + 1):
                 t = i / num_checks
                 point = (
@@ -105,6 +202,39 @@ class BoundaryChecker:
                     
         return True
 
+    def is_path_batch_valid(self, seg_start, seg_end):
+        """Batch version of is_path_valid for N straight segments, sampled the same way
+        Args:
+            seg_start: (N, 3) array of segment start points
+            seg_end: (N, 3) array of segment end points
+        Returns:
+            boolean array, True where the segment is valid
+        """
+        seg_start = np.atleast_2d(np.asarray(seg_start, dtype=float))
+        seg_end = np.atleast_2d(np.asarray(seg_end, dtype=float))
+
+        # Start and end points must be valid
+        valid = self.is_positions_valid(seg_start) & self.is_positions_valid(seg_end)
+
+        if self.obstacle_boundaries:
+            delta = seg_end - seg_start
+            distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+            num_checks = np.maximum(5, distance.astype(int))  # At least 5 checks, more for longer distances
+
+            # Sample points t = i/num_checks, i = 0..num_checks of all segments in one array
+            counts = num_checks + 1
+            first = np.cumsum(counts) - counts
+            seg_idx = np.repeat(np.arange(len(seg_start)), counts)
+            t = (np.arange(counts.sum()) - first[seg_idx]) / num_checks[seg_idx]
+            pts = seg_start[seg_idx] + t[:, None] * delta[seg_idx]
+
+            pts_valid = np.ones(len(pts), dtype=bool)
+            for obstacle in self.obstacle_boundaries:
+                pts_valid &= self._check_all(obstacle, pts)
+            valid &= np.logical_and.reduceat(pts_valid, first)
+
+        return valid
+
     def find_path(self, start_pos, end_pos):
         """Find path by first moving in +x direction to clear obstacle,
         then to target y,z, then back to target x"""
@@ -118,18 +248,16 @@ class BoundaryChecker:
         
         # Create waypoint at safe x position
         waypoint1 = (self.safe_x, y1, z1)
-        
-        # Check if path to first waypoint is valid
-        if not self.is_path_valid(start_pos, waypoint1):
-            raise ValueError("Cannot find safe path to clear obstacle in x direction")
-            
-        # Now move to target y,z coordinates while staying at safe_x
+        # Then move to target y,z coordinates while staying at safe_x
         waypoint2 = (self.safe_x, y2, z2)
-        if not self.is_path_valid(waypoint1, waypoint2):
+
+        # Check all three segments at once, finally moving back to target x
+        segment_valid = self.is_path_batch_valid([start_pos, waypoint1, waypoint2], [waypoint1, waypoint2, end_pos])
+        if not segment_valid[0]:
+            raise ValueError("Cannot find safe path to clear obstacle in x direction")
+        if not segment_valid[1]:
             raise ValueError("Cannot find safe path to target y,z coordinates")
-            
-        # Finally move back to target x
-        if not self.is_path_valid(waypoint2, end_pos):
+        if not segment_valid[2]:
             raise ValueError("Cannot find safe path to final target")
             
         return [waypoint1, waypoint2, end_pos]
@@ -261,6 +389,8 @@ def test_small_box_obstacle():
     ]
     
     # Create visualization
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure(figsize=(20, 15))
     fig.suptitle("Small Box (2x2x2) Obstacle Avoidance Tests - Valid Paths", fontsize=16)
     
@@ -330,15 +460,8 @@ def test_lapd_boundaries():
     # Create boundary checker instance
     checker = BoundaryChecker(verbose=True)  # Enable verbose mode for debugging
     
-    # Define boundaries using LAPD limits
-    def outer_boundary(x, y, z):
-        """Return True if position is within allowed range"""
-        x_limits = (-40, 60)  # (min, max) in cm
-        y_limits = (-20, 20)
-        z_limits = (-15, 15)
-        return (x_limits[0] <= x <= x_limits[1] and 
-                y_limits[0] <= y <= y_limits[1] and 
-                z_limits[0] <= z <= z_limits[1])
+    # Define boundaries using LAPD limits: x (-40, 60), y (-20, 20), z (-15, 15) in cm
+    outer_boundary = AxisAlignedBox((-40, -20, -15), (60, 20, 15))
     
     def obstacle_boundary(x, y, z):
         """Return True if position is NOT in obstacle"""
@@ -349,7 +472,7 @@ def test_lapd_boundaries():
         return not in_obstacle
     
     # Add boundaries to checker
-    checker.add_probe_boundary(outer_boundary, is_outer_boundary=True)
+    checker.add_probe_boundary_vec(outer_boundary, is_outer_boundary=True)
     checker.add_probe_boundary(obstacle_boundary)
     
     # Define test cases that require obstacle avoidance
@@ -363,6 +486,8 @@ def test_lapd_boundaries():
     ]
     
     # Create visualization
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure(figsize=(20, 15))
     fig.suptitle("LAPD Boundary and Obstacle Avoidance Tests - New Algorithm", fontsize=16)
     
@@ -568,7 +568,7 @@ class PositionManager:
         pos_list = []
 
         for mc in mc_list:
-            mc.enable
+            mc.enable()
 
         for i, mc in enumerate(mc_list):
             mc.motor_position = move_to_list[i]
@@ -590,6 +590,6 @@ class PositionManager:
                         print("Failed to move to position %.2f" %(move_to_list[i]))
 
             pos_list.append(round(pos,2))
-            mc.disable
+            mc.disable()
         
         return pos_list
\ No newline at end of file
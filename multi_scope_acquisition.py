@@ -551,18 +551,18 @@ def handle_movement(pos_manager, mc, shot_num, pos, save_path, scope_ips):
         print(f'Shot = {shot_num}, x = {pos["x"]}, y = {pos["y"]}, z = {pos["z"]}')
 
     try:
-        mc.enable
+        mc.enable()
         if pos_manager.nz is None:
             mc.probe_positions = (pos['x'], pos['y'])
         else:
             mc.probe_positions = (pos['x'], pos['y'], pos['z'])
 
         mc.wait_for_motion_complete()
-        mc.disable
+        mc.disable()
         return True
 
     except KeyboardInterrupt:
-        mc.stop_now
+        mc.stop_now()
         raise KeyboardInterrupt
     except ValueError as e:
         print(f'\nSkipping position - {str(e)}')
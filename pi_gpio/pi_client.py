@@ -317,7 +317,7 @@ class TungstenDropper:
 
     def reset_ball_count(self):
         try:
-            self.mc_w.set_zero
+            self.mc_w.set_zero()
             self.update_ball_count()
             print(f"Ball count reset to {self.ball_count}")
         except Exception as e: